@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# --- キャッシュバックエンド ---
+# どちらも get / set / delete の同じインターフェースを持つ。
+# 値はJSONに変換できるもののみ (Noneは「キャッシュなし」扱いなので保存しない)。
+
+class MemoryCache:
+    """プロセス内の辞書キャッシュ (TTL + LRU)。ワーカー間では共有されない。
+    SQLiteCacheと同じく毎回コピーを返すよう、JSON文字列で保持する"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None: return default
+            value, expires_at = item
+            if expires_at < time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return json.loads(value)
+
+    def set(self, key, value, ttl=60):
+        with self._lock:
+            self._data[key] = (json.dumps(value), time.time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SQLiteCache:
+    """SQLite(WAL)ファイルを使ったキャッシュ (TTL + LRU)。
+    同じホスト上の複数ワーカー(uvicorn --workers N)で共有できる"""
+
+    def __init__(self, path, max_entries=5000, touch_interval=5):
+        self.path = str(path)
+        self.max_entries = max_entries
+        # 読み込みのたびに書き込みロックを取らないよう、最終アクセス時刻は
+        # 前回からこの秒数以上たったときだけ更新する (LRUの順番はその分おおまかになる)
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache(accessed_at)")
+
+    def _conn(self):
+        # sqlite3の接続はスレッドをまたげないのでスレッドごとに持つ
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, default=None):
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT value, expires_at, accessed_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None: return default
+            value, expires_at, accessed_at = row
+            if expires_at < now:
+                conn.execute("DELETE FROM cache WHERE key = ? AND expires_at < ?", (key, now))
+                return default
+            if now - accessed_at >= self.touch_interval:
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return json.loads(value)
+        except sqlite3.Error as e:
+            # キャッシュが壊れていても本体の処理は止めない
+            print(f"Cache Error: {e}")
+            return default
+
+    def set(self, key, value, ttl=60):
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now),
+            )
+            # 期限切れを掃除してから、上限を超えた分を古い順に削除
+            conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT max(0, (SELECT COUNT(*) FROM cache) - ?))",
+                (self.max_entries,),
+            )
+        except sqlite3.Error as e:
+            print(f"Cache Error: {e}")
+
+    def delete(self, key):
+        try:
+            self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            print(f"Cache Error: {e}")
+
+
+def create_cache(base_dir):
+    """環境変数 CACHE_BACKEND (sqlite / memory) に応じてキャッシュを作る"""
+    backend = os.environ.get("CACHE_BACKEND", "sqlite")
+    if backend == "memory":
+        return MemoryCache()
+    path = Path(os.environ.get("CACHE_PATH", Path(base_dir) / ".cache" / "cache.sqlite3"))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return SQLiteCache(path)
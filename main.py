@@ -1,14 +1,21 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse, RedirectResponse, Response
 from typing import List, Dict, Optional
 from pydantic import BaseModel
 import os
+import asyncio
 from dotenv import load_dotenv
 from supabase import create_client
 from pathlib import Path
 import traceback
+import hashlib
+import base64
+import json
+import time
 from datetime import datetime
+from cache import create_cache
+from thumbnails import ThumbnailStore, VIDEO_ID_RE, PLACEHOLDER_URL
 
 # --- 初期設定 ---
 try:
@@ -38,13 +45,39 @@ use_supabase = bool(supabase_url and supabase_key)
 if use_supabase:
     supabase = create_client(supabase_url, supabase_key)
 
+# --- キャッシュ設定 ---
+# デフォルトはSQLiteファイルなので、uvicorn --workers N でも全ワーカーで共有される
+# キャッシュ(SQLite)を使うAPIは async にせず普通の def にする
+# (FastAPIがスレッドで実行するので、DBの待ちでイベントループが止まらない)
+cache = create_cache(current_dir)
+CHARTS_TTL = 600
+SEARCH_TTL = 300
+SONGS_TTL = 10
+# トークン→ユーザーIDのキャッシュ期間。この間はサインアウト・失効したトークンでも
+# 書き込みAPIが通ってしまうため短くしておく (トークンのexpを超えてはキャッシュしない)
+AUTH_TTL = 30
+
+# サムネイルはローカルディスクにキャッシュして /img/{videoId} で返す
+thumbnails = ThumbnailStore(
+    os.environ.get("THUMBNAIL_DIR", current_dir / ".cache" / "img"),
+    max_bytes=int(os.environ.get("THUMBNAIL_MAX_MB", "200")) * 1024 * 1024,
+)
+# 画像URLの頭に付ける公開URL (例: https://xxxx.ngrok-free.app)。空ならルート相対の /img/...
+PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "").rstrip('/')
+
+def thumb_url(vid, size=None):
+    """サムネイルURL生成 (このサーバーの /img/{videoId} を指す)"""
+    if not vid or not VIDEO_ID_RE.match(vid): return PLACEHOLDER_URL
+    url = f"{PUBLIC_BASE_URL}/img/{vid}"
+    return f"{url}?size={size}" if size else url
+
 # --- バックアップデータ (安全なvideoId付き) ---
 BACKUP_SONGS = [
-    { "id": "ZRtdQ81jPUQ", "title": "アイドル", "artist": "YOASOBI", "image": "https://img.youtube.com/vi/ZRtdQ81jPUQ/mqdefault.jpg", "videoId": "ZRtdQ81jPUQ" },
-    { "id": "H6FUBWGSOIc", "title": "Bling-Bang-Bang-Born", "artist": "Creepy Nuts", "image": "https://img.youtube.com/vi/H6FUBWGSOIc/mqdefault.jpg", "videoId": "H6FUBWGSOIc" },
-    { "id": "g8DFX_i38c0", "title": "怪獣の花唄", "artist": "Vaundy", "image": "https://img.youtube.com/vi/g8DFX_i38c0/mqdefault.jpg", "videoId": "g8DFX_i38c0" },
-    { "id": "anHcU5s3Y5o", "title": "晩餐歌", "artist": "tuki.", "image": "https://img.youtube.com/vi/anHcU5s3Y5o/mqdefault.jpg", "videoId": "anHcU5s3Y5o" },
-    { "id": "mpzI5bC4d-U", "title": "SPECIALZ", "artist": "King Gnu", "image": "https://img.youtube.com/vi/mpzI5bC4d-U/mqdefault.jpg", "videoId": "mpzI5bC4d-U" },
+    { "id": "ZRtdQ81jPUQ", "title": "アイドル", "artist": "YOASOBI", "image": thumb_url("ZRtdQ81jPUQ", "row"), "videoId": "ZRtdQ81jPUQ" },
+    { "id": "H6FUBWGSOIc", "title": "Bling-Bang-Bang-Born", "artist": "Creepy Nuts", "image": thumb_url("H6FUBWGSOIc", "row"), "videoId": "H6FUBWGSOIc" },
+    { "id": "g8DFX_i38c0", "title": "怪獣の花唄", "artist": "Vaundy", "image": thumb_url("g8DFX_i38c0", "row"), "videoId": "g8DFX_i38c0" },
+    { "id": "anHcU5s3Y5o", "title": "晩餐歌", "artist": "tuki.", "image": thumb_url("anHcU5s3Y5o", "row"), "videoId": "anHcU5s3Y5o" },
+    { "id": "mpzI5bC4d-U", "title": "SPECIALZ", "artist": "King Gnu", "image": thumb_url("mpzI5bC4d-U", "row"), "videoId": "mpzI5bC4d-U" },
 ]
 DUMMY_SONGS = []
 
@@ -86,6 +119,27 @@ def snake_to_camel(data):
         return new_d
     return data
 
+def token_exp(token):
+    """JWTのexp(有効期限)を取得。読めなければNone (署名の検証はSupabase側で行う)"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except Exception:
+        return None
+
+def get_user_id(token):
+    """トークンからユーザーIDを取得 (結果をキャッシュしてSupabaseへの問い合わせを減らす)"""
+    key = "auth:" + hashlib.sha256(token.encode()).hexdigest()
+    user_id = cache.get(key)
+    if user_id is None:
+        user_id = supabase.auth.get_user(token).user.id
+        # 期限切れのトークンがキャッシュから通らないよう、expまでに切れるTTLにする
+        exp = token_exp(token)
+        ttl = AUTH_TTL if exp is None else min(AUTH_TTL, exp - time.time())
+        if ttl > 0: cache.set(key, user_id, ttl)
+    return user_id
+
 # --- 認証API ---
 @app.post("/api/auth/signup")
 async def signup_user(req: AuthRequest):
@@ -116,31 +170,34 @@ async def signin_user(req: AuthRequest):
 
 # --- 共有API ---
 @app.get("/api/songs")
-async def get_songs():
+def get_songs():
     if not use_supabase: return JSONResponse(DUMMY_SONGS)
     try:
-        res = supabase.table("shared_songs").select("*").execute()
-        data = []
-        for s in res.data:
-            vid = s.get("videoid")
-            # 画像URL生成（安全策）
-            img = f"https://img.youtube.com/vi/{vid}/mqdefault.jpg" if vid and len(vid) > 5 else "https://via.placeholder.com/120x90?text=No+Image"
-            data.append({
-                "id": vid,
-                "title": s.get("title"),
-                "artist": s.get("artist"),
-                "sharedBy": s.get("sharedby"),
-                "distance": s.get("distance", "0m"),
-                "videoId": vid,
-                "lat": s.get("lat"),
-                "lng": s.get("lng"),
-                "image": img
-            })
+        data = cache.get("songs")
+        if data is None:
+            res = supabase.table("shared_songs").select("*").execute()
+            data = []
+            for s in res.data:
+                vid = s.get("videoid")
+                # 画像URL生成（安全策）
+                img = thumb_url(vid, "marker")
+                data.append({
+                    "id": vid,
+                    "title": s.get("title"),
+                    "artist": s.get("artist"),
+                    "sharedBy": s.get("sharedby"),
+                    "distance": s.get("distance", "0m"),
+                    "videoId": vid,
+                    "lat": s.get("lat"),
+                    "lng": s.get("lng"),
+                    "image": img
+                })
+            cache.set("songs", data, SONGS_TTL)
         return JSONResponse(data)
     except: return JSONResponse(DUMMY_SONGS)
 
 @app.post("/api/songs")
-async def add_song(song: SongRequest):
+def add_song(song: SongRequest):
     if not use_supabase: return JSONResponse({"error": "No DB"}, 500)
     try:
         data = {
@@ -153,15 +210,18 @@ async def add_song(song: SongRequest):
             supabase.table("shared_songs").update(data).eq("id", existing.data[0]['id']).execute()
         else:
             supabase.table("shared_songs").insert(data).execute()
+        cache.delete("songs")
         return JSONResponse({"status": "ok"})
     except Exception as e:
         return JSONResponse({"error": str(e)}, 500)
 
 # --- ★チャートAPI (検索ベースで確実にヒット曲を取得) ---
 @app.get("/api/charts")
-async def get_charts():
+def get_charts():
     """検索を使って安定したヒット曲を取得 (J-Pop)"""
     if not use_api: return JSONResponse(BACKUP_SONGS)
+    cached = cache.get("charts")
+    if cached is not None: return JSONResponse(cached)
     try:
         # "Official Music Video Japan" で検索すると、トレンドに近いMVが確実に取れます
         # get_chartsはサーバーの場所によって空になることがあるため、検索が一番安全です
@@ -174,33 +234,40 @@ async def get_charts():
                     "id": item['videoId'],
                     "title": item['title'],
                     "artist": item['artists'][0]['name'] if item.get('artists') else "Unknown",
-                    "image": item['thumbnails'][-1]['url']
+                    "image": thumb_url(item['videoId'], "row")
                 })
         
-        # 万が一空ならバックアップ
-        return JSONResponse(songs if songs else BACKUP_SONGS)
+        # 万が一空ならバックアップ (バックアップはキャッシュしない)
+        if not songs: return JSONResponse(BACKUP_SONGS)
+        cache.set("charts", songs, CHARTS_TTL)
+        return JSONResponse(songs)
     except Exception as e:
         print(f"Chart Error: {e}")
         return JSONResponse(BACKUP_SONGS)
 
 @app.get("/api/search")
-async def search(q: str):
+def search(q: str):
     if not use_api: return JSONResponse([])
+    # 大文字小文字・空白の違いで別々に検索しないよう正規化してから使う
+    q = " ".join(q.split()).lower()
+    key = "search:" + q
+    cached = cache.get(key)
+    if cached is not None: return JSONResponse(cached)
     try:
         res = yt.search(q, filter="videos", limit=20)
-        songs = [{"id": i['videoId'], "title": i['title'], "artist": i['artists'][0]['name'], "image": i['thumbnails'][-1]['url']} for i in res if 'videoId' in i]
+        songs = [{"id": i['videoId'], "title": i['title'], "artist": i['artists'][0]['name'], "image": thumb_url(i['videoId'], "row")} for i in res if 'videoId' in i]
+        cache.set(key, songs, SEARCH_TTL)
         return JSONResponse(songs)
     except: return JSONResponse([])
 
 # --- プレイリストAPI ---
 @app.get("/api/playlists")
-async def get_playlists(request: Request):
+def get_playlists(request: Request):
     auth = request.headers.get("Authorization")
     if not auth: return JSONResponse({"error": "Unauthorized"}, 401)
     try:
         token = auth.split(' ')[1]
-        user = supabase.auth.get_user(token)
-        user_id = user.user.id
+        user_id = get_user_id(token)
         
         playlists = supabase.table("playlists").select("*").eq("user_id", user_id).execute()
         result = []
@@ -212,13 +279,13 @@ async def get_playlists(request: Request):
     except: return JSONResponse([], 200)
 
 @app.post("/api/playlists")
-async def create_playlist(playlist: PlaylistCreate, request: Request):
+def create_playlist(playlist: PlaylistCreate, request: Request):
     auth = request.headers.get("Authorization")
     if not auth: return JSONResponse({"error": "Unauthorized"}, 401)
     try:
         token = auth.split(' ')[1]
-        user = supabase.auth.get_user(token)
-        data = {"title": playlist.title, "description": playlist.description, "user_id": user.user.id, "is_public": True}
+        user_id = get_user_id(token)
+        data = {"title": playlist.title, "description": playlist.description, "user_id": user_id, "is_public": True}
         res = supabase.table("playlists").insert(data).execute()
         return JSONResponse(snake_to_camel(res.data[0]))
     except Exception as e:
@@ -239,7 +306,7 @@ async def get_playlist_detail(playlist_id: str, request: Request):
         safe_songs = []
         for s in songs.data:
             vid = s.get("track_video_id")
-            s["image"] = f"https://img.youtube.com/vi/{vid}/mqdefault.jpg" if vid and len(vid) > 5 else "https://via.placeholder.com/120x90?text=No+Image"
+            s["image"] = thumb_url(vid, "row")
             safe_songs.append(s)
             
         data["songs"] = safe_songs
@@ -248,19 +315,19 @@ async def get_playlist_detail(playlist_id: str, request: Request):
         return JSONResponse({"error": str(e)}, 500)
 
 @app.post("/api/playlists/{playlist_id}/songs")
-async def add_song_to_playlist(playlist_id: str, song: SongAdd, request: Request):
+def add_song_to_playlist(playlist_id: str, song: SongAdd, request: Request):
     auth = request.headers.get("Authorization")
     if not auth: return JSONResponse({"error": "Unauthorized"}, 401)
     try:
         token = auth.split(' ')[1]
-        user = supabase.auth.get_user(token)
+        user_id = get_user_id(token)
         data = {
             "playlist_id": playlist_id,
             "track_video_id": song.track_video_id,
             "track_title": song.track_title,
             "artist_name": song.artist_name,
             "position": song.position,
-            "added_from_user_id": user.user.id
+            "added_from_user_id": user_id
         }
         res = supabase.table("playlist_tracks").insert(data).execute()
         return JSONResponse(snake_to_camel(res.data[0]))
@@ -269,14 +336,14 @@ async def add_song_to_playlist(playlist_id: str, song: SongAdd, request: Request
 
 # --- 削除機能 ---
 @app.delete("/api/playlists/{playlist_id}")
-async def delete_playlist(playlist_id: str, request: Request):
+def delete_playlist(playlist_id: str, request: Request):
     auth = request.headers.get("Authorization")
     if not auth: return JSONResponse({"error": "Unauthorized"}, 401)
     try:
         token = auth.split(' ')[1]
-        user = supabase.auth.get_user(token)
+        user_id = get_user_id(token)
         supabase.table("playlist_tracks").delete().eq("playlist_id", playlist_id).execute()
-        supabase.table("playlists").delete().eq("id", playlist_id).eq("user_id", user.user.id).execute()
+        supabase.table("playlists").delete().eq("id", playlist_id).eq("user_id", user_id).execute()
         return JSONResponse({"status": "deleted"})
     except Exception as e:
         return JSONResponse({"error": str(e)}, 500)
@@ -308,7 +375,7 @@ async def get_user_public_tracks(username: str):
             track_res = supabase.table("playlist_tracks").select("*").eq("playlist_id", first_playlist_id).limit(20).execute()
             for t in track_res.data:
                 vid = t.get("track_video_id")
-                img = f"https://img.youtube.com/vi/{vid}/mqdefault.jpg" if vid and len(vid) > 5 else "https://via.placeholder.com/120x90?text=No+Image"
+                img = thumb_url(vid, "row")
                 tracks.append({
                     "title": t.get("track_title"),
                     "artist": t.get("artist_name"),
@@ -318,6 +385,25 @@ async def get_user_public_tracks(username: str):
         return JSONResponse(tracks)
     except: return JSONResponse([])
 
+# --- サムネイル画像 ---
+@app.get("/img/{video_id}")
+async def get_image(video_id: str, request: Request, size: Optional[str] = None):
+    """サムネイルをディスクキャッシュから返す (size=marker / row で小さい画像)"""
+    if not VIDEO_ID_RE.match(video_id): return RedirectResponse(PLACEHOLDER_URL)
+    found = await thumbnails.get(video_id, size or "original")
+    if not found: return RedirectResponse(PLACEHOLDER_URL)
+    digest, path = found
+    # 中身のハッシュがETagなので、同じURLの画像は長期間キャッシュしてよい
+    headers = {"Cache-Control": "public, max-age=604800", "ETag": f'"{digest}"'}
+    if request.headers.get("If-None-Match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    try:
+        # 他のワーカーが削除していたら500にせずプレースホルダーへ
+        st = await asyncio.to_thread(os.stat, path)
+    except OSError:
+        return RedirectResponse(PLACEHOLDER_URL)
+    return FileResponse(path, headers=headers, media_type="image/jpeg", stat_result=st)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, proxy_headers=False)
\ No newline at end of file
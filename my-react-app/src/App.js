@@ -27,14 +27,23 @@ L.Marker.prototype.options.icon = DefaultIcon;
 
 //const API_BASE_URL = 'http://127.0.0.1:8000/api'; 
 const API_BASE_URL = 'https://hackathon-20251213.onrender.com/api';
+// サムネイルはサーバー側でキャッシュしたものを使う (/img/{videoId})
+const API_ORIGIN = API_BASE_URL.replace(/\/api$/, '');
+const IMG_BASE_URL = API_ORIGIN + '/img';
 
-const getThumbUrl = (videoId) => {
+// size: 'marker' (地図) / 'row' (リスト行) で小さい画像、省略で元サイズ
+const getThumbUrl = (videoId, size) => {
     if (!videoId || typeof videoId !== 'string' || videoId === 'default' || videoId === 'undefined' || videoId === 'null') {
         return "https://via.placeholder.com/120x90?text=No+Image";
     }
-    return `https://img.youtube.com/vi/${videoId}/mqdefault.jpg`;
+    return `${IMG_BASE_URL}/${videoId}` + (size ? `?size=${size}` : '');
 };
 
+// APIが返す画像URLが /img/... (ルート相対) ならAPIサーバーのURLを付ける
+const withApiImage = (song) => (
+    song.image && song.image.startsWith('/') ? { ...song, image: API_ORIGIN + song.image } : song
+);
+
 const formatTime = (seconds) => {
   if (!seconds) return "0:00";
   const m = Math.floor(seconds / 60);
@@ -186,7 +195,7 @@ function App() {
         () => setLocationLoaded(true)
       );
     } else { setLocationLoaded(true); }
-    axios.get(`${API_BASE_URL}/charts`).then(res => setPopularSongs(res.data)).catch(() => setPopularSongs([]));
+    axios.get(`${API_BASE_URL}/charts`).then(res => setPopularSongs(res.data.map(withApiImage))).catch(() => setPopularSongs([]));
   }, []);
 
   useEffect(() => {
@@ -259,7 +268,7 @@ function App() {
   const handleSearch = (e) => {
     if (e.key === 'Enter' && searchQuery.trim() !== "") {
       setIsSearching(true); setSearchResults([]);
-      axios.get(`${API_BASE_URL}/search?q=${searchQuery}`).then(res => setSearchResults(res.data)).catch(() => alert("検索失敗"));
+      axios.get(`${API_BASE_URL}/search?q=${searchQuery}`).then(res => setSearchResults(res.data.map(withApiImage))).catch(() => alert("検索失敗"));
     }
   };
 
@@ -534,7 +543,7 @@ function App() {
                         </div>
                         <div style={{fontSize:'9px', color:'#aaa', marginTop:'2px'}}>{dist}m</div>
                     </div>
-                    <img src={getThumbUrl(vId)} alt="art" className="song-thumb" style={{ width: '40px', height: '40px', borderRadius: '8px' }} />
+                    <img src={getThumbUrl(vId, 'row')} alt="art" className="song-thumb" style={{ width: '40px', height: '40px', borderRadius: '8px' }} />
                     <div className="song-info" style={{flex:1}}>
                       <div className="song-title" style={{ fontSize: '14px' }}>{song.title}</div>
                       <div className="song-artist" style={{ fontSize: '12px', color: '#aaa' }}>{song.artist}</div>
@@ -597,7 +606,7 @@ function App() {
                                 <div key={index} className="song-item" onClick={() => playSong(song, true)}>
                                     <span className="rank-number" style={{fontSize:'12px', color:'#666'}}>{index + 1}</span>
                                     <img 
-                                        src={getThumbUrl(vid)}
+                                        src={getThumbUrl(vid, 'row')}
                                         alt="art" className="song-thumb" 
                                     />
                                     <div className="song-info"><div className="song-title">{song.trackTitle || song.title}</div><div className="song-artist">{song.artistName || song.artist}</div></div>
@@ -0,0 +1,85 @@
+import multiprocessing
+import time
+
+import pytest
+
+from cache import MemoryCache, SQLiteCache
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_cache(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return MemoryCache(**kwargs)
+        # LRUの順番を厳密に確かめるため、読み込みのたびにアクセス時刻を更新する
+        return SQLiteCache(tmp_path / "cache.sqlite3", touch_interval=0, **kwargs)
+    return make
+
+
+def test_ttl_expiry(make_cache):
+    cache = make_cache()
+    cache.set("short", "v", ttl=0.05)
+    cache.set("long", "v", ttl=60)
+    assert cache.get("short") == "v"
+    time.sleep(0.1)
+    assert cache.get("short") is None
+    assert cache.get("short", "miss") == "miss"
+    assert cache.get("long") == "v"
+
+
+def test_lru_keeps_recently_read(make_cache):
+    cache = make_cache(max_entries=2)
+    cache.set("a", 1)
+    time.sleep(0.01)
+    cache.set("b", 2)
+    time.sleep(0.01)
+    assert cache.get("a") == 1
+    time.sleep(0.01)
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_returns_copies(make_cache):
+    cache = make_cache()
+    cache.set("songs", [{"id": "x"}])
+    cache.get("songs")[0]["image"] = "changed"
+    assert cache.get("songs") == [{"id": "x"}]
+
+
+def test_sqlite_delete_seen_by_other_instance(tmp_path):
+    # 別ワーカーが同じファイルを開いている状態 (POST /api/songs の無効化)
+    a = SQLiteCache(tmp_path / "cache.sqlite3")
+    b = SQLiteCache(tmp_path / "cache.sqlite3")
+    a.set("songs", [1, 2])
+    assert b.get("songs") == [1, 2]
+    b.delete("songs")
+    assert a.get("songs") is None
+
+
+def _write_many(path, worker):
+    cache = SQLiteCache(path, max_entries=50)
+    for i in range(100):
+        cache.set(f"{worker}-{i}", i)
+
+
+def test_sqlite_concurrent_processes(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    cache = SQLiteCache(path, max_entries=50)
+    procs = [multiprocessing.Process(target=_write_many, args=(path, w)) for w in range(4)]
+    for p in procs: p.start()
+    for p in procs: p.join()
+    assert all(p.exitcode == 0 for p in procs)
+    count = cache._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+    assert count <= 50
+
+
+def test_sqlite_read_skips_recent_touch(tmp_path):
+    cache = SQLiteCache(tmp_path / "cache.sqlite3", touch_interval=60)
+    cache.set("k", 1)
+    before = cache._conn().execute("SELECT accessed_at FROM cache WHERE key = 'k'").fetchone()[0]
+    time.sleep(0.01)
+    assert cache.get("k") == 1
+    after = cache._conn().execute("SELECT accessed_at FROM cache WHERE key = 'k'").fetchone()[0]
+    assert after == before
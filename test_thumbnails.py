@@ -0,0 +1,161 @@
+import asyncio
+import io
+import time
+
+import pytest
+from PIL import Image
+
+import thumbnails
+from thumbnails import ThumbnailStore
+
+
+def jpeg(color, size=(320, 180)):
+    out = io.BytesIO()
+    Image.new("RGB", size, color).save(out, "JPEG")
+    return out.getvalue()
+
+
+class StubFetcher:
+    """YouTubeの代わりに決まった画像を返す"""
+
+    def __init__(self, images, delay=0):
+        self.images = images
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, video_id):
+        self.calls.append(video_id)
+        time.sleep(self.delay)
+        return self.images.get(video_id)
+
+
+def objects(store):
+    return list(store.objects.glob("*/*.jpg"))
+
+
+def test_single_flight(tmp_path):
+    fetcher = StubFetcher({"abcdef1": jpeg("red")}, delay=0.1)
+    store = ThumbnailStore(tmp_path, fetcher=fetcher)
+
+    async def run():
+        return await asyncio.gather(*[store.get("abcdef1", "row") for _ in range(10)])
+
+    results = asyncio.run(run())
+    assert fetcher.calls == ["abcdef1"]
+    assert all(r == results[0] for r in results)
+    assert results[0][1].read_bytes()
+
+
+def test_same_image_stored_once(tmp_path):
+    data = jpeg("blue")
+    store = ThumbnailStore(tmp_path, fetcher=StubFetcher({"abcdef1": data, "abcdef2": data}))
+    a = asyncio.run(store.get("abcdef1"))
+    b = asyncio.run(store.get("abcdef2"))
+    assert a == b
+    # 元画像 + 小さいサイズ2つ (videoIdが2つでも増えない)
+    assert len(objects(store)) == 1 + len(thumbnails.VARIANTS)
+
+
+def test_evicts_under_max_bytes(tmp_path):
+    images = {f"vid000{i}": jpeg((i * 40, 0, 0)) for i in range(5)}
+    size = len(images["vid0000"])
+    store = ThumbnailStore(tmp_path, fetcher=StubFetcher(images), max_bytes=size * 2)
+    for vid in images:
+        assert asyncio.run(store.get(vid))
+    assert sum(p.stat().st_size for p in objects(store)) <= store.max_bytes
+    assert store.total_bytes <= store.max_bytes
+    # 一番新しい画像は残り、最初の画像の対応は片付けられている
+    assert store._lookup("vid0004", "original")
+    assert not (store.ids / "vid0000.original").exists()
+
+
+def test_transient_error_is_not_remembered(tmp_path):
+    calls = []
+
+    def broken(video_id):
+        calls.append(video_id)
+        raise OSError("network down")
+
+    store = ThumbnailStore(tmp_path, fetcher=broken)
+    assert asyncio.run(store.get("abcdef1")) is None
+    # 一時的な失敗なので次のリクエストでまた取りに行き、直れば返せる
+    store.fetcher = StubFetcher({"abcdef1": jpeg("red")})
+    assert asyncio.run(store.get("abcdef1"))
+    assert calls == ["abcdef1"]
+
+
+def test_missing_thumbnail_is_remembered(tmp_path):
+    fetcher = StubFetcher({})
+    store = ThumbnailStore(tmp_path, fetcher=fetcher)
+    assert asyncio.run(store.get("abcdef1")) is None
+    # 別ワーカーからも問い合わせない
+    assert asyncio.run(ThumbnailStore(tmp_path, fetcher=fetcher).get("abcdef1")) is None
+    assert fetcher.calls == ["abcdef1"]
+
+
+def test_max_bytes_shared_between_workers(tmp_path):
+    images = {f"vid{i:04d}": jpeg((i * 6, 255 - i * 6, 0)) for i in range(40)}
+    size = max(len(d) for d in images.values())
+    # 同じディレクトリを使う2つのワーカー
+    stores = [ThumbnailStore(tmp_path, fetcher=StubFetcher(images), max_bytes=size * 10) for _ in range(2)]
+    for i, vid in enumerate(images):
+        assert asyncio.run(stores[i % 2].get(vid))
+    on_disk = sum(p.stat().st_size for p in objects(stores[0]))
+    assert on_disk <= size * 10
+    assert stores[0].total_bytes == stores[1].total_bytes == on_disk
+
+
+def test_index_survives_without_shared_cache(tmp_path):
+    fetcher = StubFetcher({"abcdef1": jpeg("green")})
+    asyncio.run(ThumbnailStore(tmp_path, fetcher=fetcher).get("abcdef1"))
+    # 別ワーカー(別インスタンス)からでもディスク上の対応表で見つかる
+    assert asyncio.run(ThumbnailStore(tmp_path, fetcher=fetcher).get("abcdef1", "marker"))
+    assert fetcher.calls == ["abcdef1"]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    pytest.importorskip("httpx")
+    monkeypatch.setenv("CACHE_BACKEND", "memory")
+    monkeypatch.setenv("THUMBNAIL_DIR", str(tmp_path / "startup"))
+    import main
+    from fastapi.testclient import TestClient
+
+    fetcher = StubFetcher({"abcdef1": jpeg("red")})
+    monkeypatch.setattr(main, "thumbnails", ThumbnailStore(tmp_path / "img", fetcher=fetcher))
+    return TestClient(main.app)
+
+
+def test_image_endpoint_etag(client):
+    res = client.get("/img/abcdef1?size=row")
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "image/jpeg"
+    assert "max-age" in res.headers["cache-control"]
+    res = client.get("/img/abcdef1?size=row", headers={"If-None-Match": res.headers["etag"]})
+    assert res.status_code == 304
+
+
+def test_image_endpoint_invalid_id_redirects(client):
+    res = client.get("/img/bad!id", follow_redirects=False)
+    assert res.status_code in (302, 307)
+    assert res.headers["location"] == thumbnails.PLACEHOLDER_URL
+
+
+def test_image_endpoint_file_removed(client, monkeypatch, tmp_path):
+    import main
+
+    async def vanished(video_id, variant="original"):
+        # 見つけた直後に他のワーカーが削除した状態
+        return "0" * 64, tmp_path / "gone.jpg"
+
+    monkeypatch.setattr(main.thumbnails, "get", vanished)
+    res = client.get("/img/abcdef1", follow_redirects=False)
+    assert res.headers["location"] == thumbnails.PLACEHOLDER_URL
+
+
+def test_charts_images_use_local_proxy(client, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "use_api", False)
+    songs = client.get("/api/charts").json()
+    assert songs
+    assert all(s["image"] == f"/img/{s['id']}?size=row" for s in songs)
@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+# Pillowがあれば小さいサイズも事前に生成する (無ければ元画像をそのまま返す)
+try:
+    from PIL import Image
+    use_pillow = True
+except ImportError:
+    use_pillow = False
+
+VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{6,20}$")
+PLACEHOLDER_URL = "https://via.placeholder.com/120x90?text=No+Image"
+# 地図のマーカー用・リスト行用の小さいサイズ (幅px)
+VARIANTS = {"marker": 48, "row": 120}
+# 取得できなかったvideoIdは、この秒数の間YouTubeへ問い合わせない
+MISSING_TTL = 600
+
+
+def fetch_youtube_thumbnail(video_id):
+    """YouTubeからサムネイル(mqdefault)を取得。
+    サムネイルが無い(404)ときはNone、通信エラーや5xxは例外 (一時的な失敗なので覚えない)"""
+    res = requests.get(f"https://img.youtube.com/vi/{video_id}/mqdefault.jpg", timeout=5)
+    if res.status_code == 404: return None
+    res.raise_for_status()
+    return res.content or None
+
+
+def make_variant(data, width):
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    img.thumbnail((width, width * 3 // 4))
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=80, optimize=True)
+    return out.getvalue()
+
+
+def write_atomic(path, data):
+    # 他のワーカーが途中のファイルを読まないように一時ファイル → rename
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+class ThumbnailStore:
+    """サムネイルのディスクキャッシュ。
+    画像は中身のsha256をファイル名にして objects/ に保存し(同じ画像は1つだけ)、
+    videoId → ハッシュの対応は ids/{videoId}.{variant} ファイルに持つ。
+    どちらもディスク上にあるので複数ワーカーで共有される。
+    合計サイズも全ワーカーで共有するため size.sqlite3 に持つ。
+    fetcher を差し替えればテスト時にYouTubeへ取りに行かない。
+    fetcher は画像が無ければNoneを返し、一時的な失敗は例外にする"""
+
+    def __init__(self, root, fetcher=fetch_youtube_thumbnail, max_bytes=200 * 1024 * 1024):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.ids = self.root / "ids"
+        self.fetcher = fetcher
+        self.max_bytes = max_bytes
+        self._inflight = {}
+        self._local = threading.local()
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.ids.mkdir(parents=True, exist_ok=True)
+        # 合計サイズはファイルが無いときだけ数え、以降は保存・削除のたびに増減させる
+        conn = self._db()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+        if conn.execute("SELECT total FROM size").fetchone() is None:
+            total = sum(st.st_size for st, _ in self._scan())
+            conn.execute("INSERT OR IGNORE INTO size (id, total) VALUES (0, ?)", (total,))
+
+    def _db(self):
+        # sqlite3の接続はスレッドをまたげないのでスレッドごとに持つ
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.root / "size.sqlite3"), timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    @property
+    def total_bytes(self):
+        return self._db().execute("SELECT total FROM size").fetchone()[0]
+
+    def _add_bytes(self, n):
+        self._db().execute("UPDATE size SET total = max(0, total + ?)", (n,))
+
+    def _path(self, digest):
+        return self.objects / digest[:2] / f"{digest}.jpg"
+
+    def _scan(self):
+        files = []
+        for p in self.objects.glob("*/*.jpg"):
+            try:
+                files.append((p.stat(), p))
+            except OSError:
+                continue
+        return files
+
+    def _lookup(self, video_id, variant):
+        try:
+            digest = (self.ids / f"{video_id}.{variant}").read_text()
+            path = self._path(digest)
+            # 最終アクセス時刻として更新 (削除時に古い順で消すため)
+            os.utime(path)
+        except OSError:
+            return None
+        return digest, path
+
+    def _is_missing(self, video_id):
+        try:
+            return time.time() - (self.ids / f"{video_id}.missing").stat().st_mtime < MISSING_TTL
+        except OSError:
+            return False
+
+    def _store(self, video_id, variant, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            write_atomic(path, data)
+            self._add_bytes(len(data))
+        write_atomic(self.ids / f"{video_id}.{variant}", digest.encode())
+
+    def _evict(self):
+        """上限を超えていたら古い画像から削除 (上限の9割まで減らす)"""
+        if self.total_bytes <= self.max_bytes: return
+        files = self._scan()
+        total = sum(st.st_size for st, _ in files)
+        if total <= self.max_bytes * 0.9:
+            # 同じ画像を同時に保存した等で数え過ぎていたので実際の値に合わせる
+            self._db().execute("UPDATE size SET total = ?", (total,))
+            return
+        removed = set()
+        for st, p in sorted(files, key=lambda f: f[0].st_mtime):
+            if total <= self.max_bytes * 0.9: break
+            try:
+                p.unlink()
+            except OSError:
+                # 他のワーカーが先に消した (その分はそちらで減らす)
+                continue
+            total -= st.st_size
+            self._add_bytes(-st.st_size)
+            removed.add(p.stem)
+        # 消した画像を指しているvideoIdの対応と、古い「取得失敗」の印も片付ける
+        for p in self.ids.iterdir():
+            try:
+                if p.suffix == ".missing":
+                    if time.time() - p.stat().st_mtime >= MISSING_TTL: p.unlink()
+                elif p.suffix != ".tmp" and p.read_text() in removed:
+                    p.unlink()
+            except OSError:
+                continue
+
+    def _fetch_and_store(self, video_id):
+        try:
+            data = self.fetcher(video_id)
+        except Exception as e:
+            # 通信エラー等の一時的な失敗は覚えず、次のリクエストでまた取りに行く
+            print(f"Thumbnail Error: {e}")
+            return False
+        if not data:
+            # YouTubeに画像が無いとはっきりしたときだけ、しばらく問い合わせない
+            try:
+                (self.ids / f"{video_id}.missing").touch()
+            except OSError:
+                pass
+            return False
+        try:
+            self._store(video_id, "original", data)
+            if use_pillow:
+                for name, width in VARIANTS.items():
+                    try:
+                        self._store(video_id, name, make_variant(data, width))
+                    except Exception as e:
+                        # 小さい画像が作れなくても元画像は返せる
+                        print(f"Thumbnail Error: {e}")
+            self._evict()
+        except Exception as e:
+            # ディスクがいっぱい・権限がない等。画像が返せないだけで本体は止めない
+            print(f"Thumbnail Error: {e}")
+            return False
+        return True
+
+    def _find(self, video_id, variant):
+        return self._lookup(video_id, variant) or self._lookup(video_id, "original")
+
+    async def get(self, video_id, variant="original"):
+        """(ハッシュ, ファイルパス) を返す。取得できなければNone"""
+        if variant not in VARIANTS: variant = "original"
+        # ディスクの読み書きはイベントループを止めないようスレッドで行う
+        found = await asyncio.to_thread(self._find, video_id, variant)
+        if found: return found
+        if await asyncio.to_thread(self._is_missing, video_id): return None
+        # 同じvideoIdへの同時リクエストは1回の取得にまとめる
+        task = self._inflight.get(video_id)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(self._fetch_and_store, video_id))
+            self._inflight[video_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(video_id, None))
+        if not await asyncio.shield(task): return None
+        return await asyncio.to_thread(self._find, video_id, variant)